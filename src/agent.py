@@ -1,34 +1,577 @@
+import ast
+import atexit
+import builtins
+import copy
+import functools
+import hashlib
 import io
 import logging
-from typing import List, Optional, Tuple, Union
+import logging.handlers
+import queue
+import re
+import reprlib
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 
 import matplotlib.figure
+import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.tools import tool
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langfuse.langchain import CallbackHandler
 from langgraph.graph import END, START, MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+if not logging.getLogger().handlers:
+    # Records are formatted by the QueueHandler and written to stderr by a
+    # listener thread, so logging calls on the chat path don't block on I/O.
+    _log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.handlers.QueueHandler(_log_queue)],
+    )
 logger = logging.getLogger(__name__)
 
-langfuse_callback_handler = CallbackHandler()
+FIGURE_DPI = 100
+
+MAX_ARTIFACT_ROWS = 1000
+
+MAX_RESULT_CHARS = 2000
+
+RESPONSE_CACHE_SIZE = 128
+
+QUERY_RESULT_CACHE_SIZE = 32
+
+MAX_HISTORY_TURNS = 6
+
+STREAM_FLUSH_INTERVAL = 0.05
+
+QUERY_ERROR_PREFIX = "Error executing query"
+
+_FAST_PATHS = (
+    (
+        re.compile(
+            r"(?:what are the |list the |show (?:me )?the )?(?:column names|columns)"
+            r"(?: in the (?:data ?set|data ?frame|data))?\??"
+        ),
+        lambda df: "The DataFrame contains the columns: "
+        + ", ".join(map(str, df.columns))
+        + ".",
+    ),
+    (
+        re.compile(
+            r"how many rows(?: are there)?(?: in the (?:data ?set|data ?frame|data))?\??"
+            r"|row count\??"
+        ),
+        lambda df: f"The DataFrame has {len(df):,} rows.",
+    ),
+    (
+        re.compile(
+            r"(?:what are the )?(?:column )?(?:data ?types|dtypes)(?: of the columns)?\??"
+        ),
+        lambda df: "The column data types are:\n"
+        + "\n".join(f"- {column}: {dtype}" for column, dtype in df.dtypes.items()),
+    ),
+)
+
+SAFE_BUILTINS = {
+    name: getattr(builtins, name)
+    for name in (
+        "abs",
+        "all",
+        "any",
+        "bool",
+        "dict",
+        "enumerate",
+        "float",
+        "int",
+        "len",
+        "list",
+        "max",
+        "min",
+        "range",
+        "round",
+        "set",
+        "sorted",
+        "str",
+        "sum",
+        "tuple",
+        "zip",
+    )
+}
+
+# Syntax allowed in tool queries: expressions, lambdas and comprehensions.
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.Constant,
+    ast.Name,
+    ast.Load,
+    ast.Store,
+    ast.Attribute,
+    ast.Subscript,
+    ast.Slice,
+    ast.Call,
+    ast.keyword,
+    ast.Compare,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.BoolOp,
+    ast.IfExp,
+    ast.List,
+    ast.Tuple,
+    ast.Dict,
+    ast.Set,
+    ast.ListComp,
+    ast.SetComp,
+    ast.DictComp,
+    ast.GeneratorExp,
+    ast.comprehension,
+    ast.Lambda,
+    ast.arguments,
+    ast.arg,
+    ast.JoinedStr,
+    ast.FormattedValue,
+    ast.operator,
+    ast.unaryop,
+    ast.boolop,
+    ast.cmpop,
+)
+
+# Attributes and methods tool queries may use, on any object: pandas
+# DataFrame/Series/Index/GroupBy methods, the .str/.dt/.cat accessors, plotting
+# and the pandas functions reachable through `pd`.
+_ALLOWED_ATTRIBUTES = frozenset("""
+    abs add agg aggregate align all any apply applymap area argmax argmin assign
+    astype at axes bar barh between bfill box boxplot capitalize cat categories
+    clip codes columns combine_first contains copy corr corrwith count cov
+    cumcount cummax cummin cumprod cumsum date day day_name dayofweek dayofyear
+    days density describe diff div divide dot drop drop_duplicates dropna dt
+    dtype dtypes duplicated empty endswith eq ewm expanding explode extract
+    ffill figure fillna filter findall first floor floordiv fullmatch ge get
+    get_dummies get_figure grid groupby groups gt head hist hour iat idxmax
+    idxmin iloc index infer_objects interpolate is_monotonic_decreasing
+    is_monotonic_increasing is_unique isalpha isdigit isin isna isnull isnumeric
+    item items join kde keys kurt kurtosis last le legend len line loc lower
+    lstrip lt map mask match max mean median melt memory_usage merge min minute
+    mod mode month month_name mul multiply name names ndim ne ngroup ngroups
+    nlargest notna notnull nsmallest nth nunique pct_change pie pivot
+    pivot_table plot pow prod product quantile quarter rank reindex rename
+    replace resample reset_index reshape rolling round rstrip sample scatter
+    second select_dtypes sem set_index set_title set_xlabel set_ylabel shape
+    shift size skew slice sort_index sort_values split squeeze stack startswith
+    std str strftime strip sub subtract sum T tail title to_dict to_frame
+    to_list to_numpy tolist total_seconds transform transpose unique unstack
+    upper value_counts values var weekday where xs year zfill
+    Categorical DataFrame NA NaT Series Timedelta Timestamp concat crosstab cut
+    date_range qcut to_datetime to_numeric to_timedelta
+    to_csv to_html to_json to_latex to_markdown to_string to_xml
+    """.split())
+
+# Text exporters are allowed only when called without a target, in which case
+# they return a string.
+_TEXT_EXPORTERS = frozenset(
+    ("to_csv", "to_html", "to_json", "to_latex", "to_markdown", "to_string", "to_xml")
+)
+_EXPORT_TARGETS = frozenset(("buf", "path_or_buf", "path_or_buffer"))
+
+# Methods that look up a function by name when given a string, such as
+# df.agg('mean').
+_DISPATCH_METHODS = frozenset(
+    ("agg", "aggregate", "apply", "applymap", "map", "transform")
+)
+_DISPATCH_FUNCTIONS = _ALLOWED_ATTRIBUTES - _TEXT_EXPORTERS
+
+_result_repr = reprlib.Repr()
+_result_repr.maxlist = _result_repr.maxtuple = 100
+_result_repr.maxset = _result_repr.maxfrozenset = _result_repr.maxdict = 100
+_result_repr.maxstring = _result_repr.maxother = 200
+
+_ARTIFACT_KEYS = {
+    pd.DataFrame: "dataframe_artifact",
+    pd.Series: "dataframe_artifact",
+    matplotlib.figure.Figure: "figure_artifact",
+    bytes: "figure_artifact",
+}
+
+_ARTIFACT_KWARGS = frozenset(_ARTIFACT_KEYS.values())
+
+_schema_cache: Dict[int, Tuple[Tuple, str]] = {}
+
+_response_cache: "OrderedDict[Tuple[str, str, str], List[BaseMessage]]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def strip_artifacts(payload):
+    """Return a copy of a callback payload with artifacts removed from message `additional_kwargs`."""
+    if isinstance(payload, BaseMessage):
+        if _ARTIFACT_KWARGS.isdisjoint(payload.additional_kwargs):
+            return payload
+        additional_kwargs = {
+            key: value
+            for key, value in payload.additional_kwargs.items()
+            if key not in _ARTIFACT_KWARGS
+        }
+        return payload.model_copy(update={"additional_kwargs": additional_kwargs})
+    if isinstance(payload, dict):
+        return {key: strip_artifacts(value) for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return type(payload)(strip_artifacts(value) for value in payload)
+    return payload
+
+
+class ArtifactFilteringCallbackHandler(CallbackHandler):
+    """Langfuse callback handler that keeps DataFrame and Figure artifacts out of trace payloads."""
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        return super().on_chain_start(serialized, strip_artifacts(inputs), **kwargs)
+
+    def on_chain_end(self, outputs, **kwargs):
+        return super().on_chain_end(strip_artifacts(outputs), **kwargs)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        return super().on_chat_model_start(
+            serialized, strip_artifacts(messages), **kwargs
+        )
+
+
+langfuse_callback_handler = ArtifactFilteringCallbackHandler()
 
 
 def get_dataframe_schema(df: pd.DataFrame) -> str:
     """Get DataFrame schema as a string."""
-    buffer = io.StringIO()
-    df.info(buf=buffer, memory_usage=False, verbose=True, show_counts=True)
+    null_counts = np.zeros(len(df.columns), dtype=np.int64)
+    may_have_nulls = np.array(
+        [
+            not (isinstance(dtype, np.dtype) and dtype.kind in "iub")
+            for dtype in df.dtypes
+        ],
+        dtype=bool,
+    )
+    if may_have_nulls.any():
+        null_counts[may_have_nulls] = df.iloc[:, may_have_nulls].isna().sum().to_numpy()
+    non_null_counts = len(df) - null_counts
+    dtypes = df.dtypes.astype(str).to_numpy()
+    lines = [f"Rows: {len(df)}, Columns: {len(df.columns)}"]
+    lines.extend(
+        f"{i} {column} {count} non-null {dtype}"
+        for i, (column, count, dtype) in enumerate(
+            zip(df.columns, non_null_counts, dtypes)
+        )
+    )
+    return "\n".join(lines)
+
+
+def get_dataframe_schema_cached(df: pd.DataFrame) -> str:
+    """Get DataFrame schema as a string, reusing it while the DataFrame's shape and dtypes are unchanged."""
+    key = (df.shape, tuple(df.dtypes.astype(str)))
+    cached = _schema_cache.get(id(df))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    schema = get_dataframe_schema(df)
+    if id(df) not in _schema_cache:
+        weakref.finalize(df, _schema_cache.pop, id(df), None)
+    _schema_cache[id(df)] = (key, schema)
+    return schema
+
+
+@functools.lru_cache(maxsize=256)
+def parse_query(query: str) -> ast.Expression:
+    """Parse a query string into an expression AST, caching it for repeated queries.
+
+    The returned tree is shared between callers and must not be modified.
+    """
+    return ast.parse(query, mode="eval")
+
+
+def get_dispatch_arguments(call: ast.Call) -> List[ast.expr]:
+    """Get the arguments of a dispatch method call such as `agg` that pandas may resolve to functions."""
+    return [
+        *call.args[:1],
+        *(
+            keyword.value
+            for keyword in call.keywords
+            if keyword.arg in ("func", "arg")
+            or (call.func.attr in ("agg", "aggregate") and keyword.arg != "axis")
+        ),
+    ]
+
+
+def validate_dispatch_argument(method: str, value: ast.expr):
+    """Reject dispatch method arguments other than allowed function names, lambdas and literal containers of them.
+
+    Computed values are rejected because their string value is only known
+    when the query runs.
+    """
+    if isinstance(value, ast.Constant):
+        if isinstance(value.value, str) and value.value not in _DISPATCH_FUNCTIONS:
+            raise ValueError(
+                f"Function '{value.value}' is not allowed in '{method}' queries."
+            )
+    elif isinstance(value, ast.List):
+        for element in value.elts:
+            validate_dispatch_argument(method, element)
+    elif isinstance(value, ast.Tuple) and value.elts:
+        # Named aggregation: ('column', 'function').
+        for element in value.elts[:-1]:
+            if not isinstance(element, ast.Constant):
+                raise ValueError(
+                    f"Named aggregations in '{method}' queries must use literal column names."
+                )
+        validate_dispatch_argument(method, value.elts[-1])
+    elif isinstance(value, ast.Dict):
+        # Column-to-function mappings; `map` dictionaries map values instead.
+        if method != "map":
+            for element in value.values:
+                validate_dispatch_argument(method, element)
+    elif not isinstance(value, ast.Lambda):
+        raise ValueError(
+            f"'{method}' accepts only function names as string literals, lambdas, "
+            "and lists or dictionaries of them in queries."
+        )
+
+
+def validate_query(tree: ast.Expression):
+    """Reject queries that use syntax, names or attributes outside the allow-lists."""
+    bound_names = {
+        node.arg if isinstance(node, ast.arg) else node.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.arg)
+        or (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store))
+    }
+    allowed_names = {"df", "pd", *SAFE_BUILTINS, *bound_names}
+    exporter_calls = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(
+                f"'{type(node).__name__}' expressions are not allowed in queries."
+            )
+        if isinstance(node, ast.Name) and node.id not in allowed_names:
+            raise ValueError(f"Name '{node.id}' is not allowed in queries.")
+        if isinstance(node, ast.keyword) and node.arg is None:
+            raise ValueError("Keyword argument unpacking is not allowed in queries.")
+        if isinstance(node, ast.keyword) and node.arg == "inplace":
+            # The DataFrame is shared and fingerprinted once per upload.
+            raise ValueError("In-place modification is not allowed in queries.")
+        if isinstance(node, ast.Attribute) and node.attr not in _ALLOWED_ATTRIBUTES:
+            raise ValueError(f"Attribute '{node.attr}' is not allowed in queries.")
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        if node.func.attr in _TEXT_EXPORTERS:
+            if node.args or any(
+                keyword.arg in _EXPORT_TARGETS for keyword in node.keywords
+            ):
+                raise ValueError(
+                    f"'{node.func.attr}' may not write to a file or buffer in queries."
+                )
+            exporter_calls.add(node.func)
+        elif node.func.attr in _DISPATCH_METHODS:
+            for argument in get_dispatch_arguments(node):
+                validate_dispatch_argument(node.func.attr, argument)
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Attribute)
+            and node.attr in _TEXT_EXPORTERS
+            and node not in exporter_calls
+        ):
+            raise ValueError(f"'{node.attr}' may only be called directly in queries.")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(query: str):
+    """Validate and compile a query string into a code object, caching it for repeated queries."""
+    tree = parse_query(query)
+    validate_query(tree)
+    return compile(tree, "<tool>", "eval")
+
+
+def normalize_column_name(name: str) -> str:
+    """Normalize a column name for alias lookups, ignoring case, spaces and hyphens."""
+    return re.sub(r"[\s\-_]+", "_", name.strip().lower())
+
+
+@functools.lru_cache(maxsize=8)
+def get_column_aliases(columns: Tuple[Any, ...]) -> Dict[str, str]:
+    """Map normalized column names to the DataFrame's string column names."""
+    aliases: Dict[str, str] = {}
+    for column in columns:
+        if isinstance(column, str):
+            aliases.setdefault(normalize_column_name(column), column)
+    return aliases
+
+
+class _ColumnAliasTransformer(ast.NodeTransformer):
+    """Replaces mistyped column names in `df['col']` and `df[['a', 'b']]` with the DataFrame's column names."""
+
+    def __init__(self, columns: Tuple[Any, ...]):
+        self.columns = set(columns)
+        self.aliases = get_column_aliases(columns)
+        self.corrections: List[Tuple[str, str]] = []
+
+    def visit_Subscript(self, node: ast.Subscript) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.value, ast.Name) and node.value.id == "df":
+            keys = (
+                node.slice.elts
+                if isinstance(node.slice, (ast.List, ast.Tuple))
+                else [node.slice]
+            )
+            for key in keys:
+                if (
+                    isinstance(key, ast.Constant)
+                    and isinstance(key.value, str)
+                    and key.value not in self.columns
+                ):
+                    column = self.aliases.get(normalize_column_name(key.value))
+                    if column is not None:
+                        self.corrections.append((key.value, column))
+                        key.value = column
+        return node
+
+
+@functools.lru_cache(maxsize=256)
+def resolve_column_aliases(
+    query: str, columns: Tuple[Any, ...]
+) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """Correct column names in a query that differ from the DataFrame's only in case, spacing or hyphens.
+
+    Returns the query to run and the (alias, column) corrections applied.
+    """
+    try:
+        tree = parse_query(query)
+    except SyntaxError:
+        return query, ()
+    transformer = _ColumnAliasTransformer(columns)
+    resolved_tree = transformer.visit(copy.deepcopy(tree))
+    if not transformer.corrections:
+        return query, ()
+    return ast.unparse(resolved_tree), tuple(transformer.corrections)
+
+
+def evaluate_query(df: pd.DataFrame, query: str):
+    """Evaluate a validated query against the DataFrame."""
+    return eval(
+        compile_query(query), {"__builtins__": SAFE_BUILTINS, "df": df, "pd": pd}, {}
+    )
+
+
+def get_artifact_key(artifact) -> Optional[str]:
+    """Get the AIMessage `additional_kwargs` key for an artifact, or None if its type is unsupported."""
+    key = _ARTIFACT_KEYS.get(type(artifact))
+    if key is None:
+        for artifact_type, artifact_key in _ARTIFACT_KEYS.items():
+            if isinstance(artifact, artifact_type):
+                return artifact_key
+    return key
+
+
+def get_dataframe_fingerprint(df: pd.DataFrame) -> Optional[str]:
+    """Get a content hash of the DataFrame, including column names and dtypes, or None if it cannot be hashed."""
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    except TypeError:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((list(df.columns), list(df.dtypes.astype(str)))).encode())
+    digest.update(row_hashes.tobytes())
+    return digest.hexdigest()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a user query for response cache lookups."""
+    return " ".join(query.lower().split())
+
+
+def get_fast_path_answer(df: pd.DataFrame, user_query: str) -> Optional[str]:
+    """Answer questions about the DataFrame's structure directly, or return None if the query needs the model."""
+    normalized_query = normalize_query(user_query)
+    for pattern, answer in _FAST_PATHS:
+        if pattern.fullmatch(normalized_query):
+            return answer(df)
+    return None
+
+
+def trim_history(
+    messages: List[BaseMessage], max_turns: int = MAX_HISTORY_TURNS
+) -> List[BaseMessage]:
+    """Keep the leading system message and the messages of the last `max_turns` user queries."""
+    turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if len(turn_starts) <= max_turns:
+        return messages
+    recent_messages = messages[turn_starts[-max_turns] :]
+    if isinstance(messages[0], SystemMessage):
+        return [messages[0], *recent_messages]
+    return recent_messages
+
+
+def get_stream_text(message: BaseMessage, metadata: Dict[str, Any]) -> Optional[str]:
+    """Get the response text of a streamed message chunk, or None if it is not model output from the agent node."""
+    if (
+        metadata.get("langgraph_node") == "agent"
+        and isinstance(message, AIMessageChunk)
+        and isinstance(message.content, str)
+    ):
+        return message.content
+    return None
+
+
+def throttle_stream(
+    chunks: Iterator[str], interval: float = STREAM_FLUSH_INTERVAL
+) -> Iterator[str]:
+    """Batch streamed text chunks so they are yielded at most once per `interval` seconds."""
+    buffer = []
+    last_flush = time.monotonic()
+    for chunk in chunks:
+        buffer.append(chunk)
+        now = time.monotonic()
+        if now - last_flush >= interval:
+            yield "".join(buffer)
+            buffer.clear()
+            last_flush = now
+    if buffer:
+        yield "".join(buffer)
+
+
+def render_figure(figure: matplotlib.figure.Figure) -> bytes:
+    """Render a Matplotlib figure to PNG bytes and close it."""
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=FIGURE_DPI, bbox_inches="tight")
+    plt.close(figure)
     return buffer.getvalue()
 
 
-def get_system_prompt(dataframe_schema: str) -> str:
-    """Get system prompt for the agent."""
-    return f"""
+def describe_result(result) -> str:
+    """Describe a query result for the tool message without stringifying large artifacts."""
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return f"a {type(result).__name__} with shape {result.shape}"
+    if isinstance(result, (list, tuple, set, frozenset, dict)):
+        return _result_repr.repr(result)
+    text = str(result)
+    if len(text) > MAX_RESULT_CHARS:
+        return (
+            f"{text[:MAX_RESULT_CHARS]}... (truncated, {len(text)} characters in total)"
+        )
+    return text
+
+
+_SYSTEM_PROMPT_HEAD = """
 You are a helpful AI assistant for data analysis.
 You have access to a pandas DataFrame, referred to as 'df', which you can interact with using Python code.
 
@@ -44,78 +587,327 @@ You have access to a pandas DataFrame, referred to as 'df', which you can intera
 ## Tool Use
 - If a query is needed, write a valid pandas expression using standard syntax.
 - For plotting, ensure your query returns a `matplotlib.figure.Figure` object.
+- Query rules: access columns as `df['col']`, not `df.col`; do not use `df.query`, `df.eval`, `df.info()` or `str.format` (use f-strings instead); pass functions to `apply`, `agg`, `map` and `transform` as lambdas or quoted names such as `'mean'`; never modify `df` in place or write to files.
 - Examples of valid queries:
-    - View the first 5 rows: "df.head()"
-    - Filter rows where 'age' is greater than 30: "df[df['age'] > 30]"
-    - Count unique values in the 'gender' column: "df['gender'].value_counts()"
-    - Get summary statistics for all numeric columns: "df.describe()"
-    - Find rows with missing values in 'income': "df[df['income'].isnull()]"
+"""
 
+# Each example is paired with the columns it references; examples referencing
+# columns missing from the DataFrame are left out of the prompt.
+_QUERY_EXAMPLES: Tuple[Tuple[Tuple[str, ...], str, str], ...] = (
+    ((), "View the first 5 rows", "df.head()"),
+    (("age",), "Filter rows where 'age' is greater than 30", "df[df['age'] > 30]"),
+    (
+        ("gender",),
+        "Count unique values in the 'gender' column",
+        "df['gender'].value_counts()",
+    ),
+    ((), "Get summary statistics for all numeric columns", "df.describe()"),
+    (
+        ("income",),
+        "Find rows with missing values in 'income'",
+        "df[df['income'].isnull()]",
+    ),
+    (
+        (),
+        "Plot a histogram of a numeric column",
+        "df['<column>'].plot(kind='hist').figure",
+    ),
+)
+
+_SYSTEM_PROMPT_EXAMPLES_HEADER = """
 After executing any tool-based query, interpret the results and give a clear, user-friendly answer.
 
 ## End-to-end Examples
 
-1.  **User**: What are the column names?
-    **Tool**: `list(df.columns)` → `['age', 'income', 'gender']`
-    **Response**: The DataFrame contains the columns: age, income, and gender.
+"""
 
-2.  **User**: Show the dataset's statistical summary.
+_END_TO_END_EXAMPLES: Tuple[Tuple[Tuple[str, ...], str], ...] = (
+    (
+        (),
+        """**User**: What are the column names?
+    **Tool**: `list(df.columns)` → `['age', 'income', 'gender']`
+    **Response**: The DataFrame contains the columns: age, income, and gender.""",
+    ),
+    (
+        (),
+        """**User**: Show the dataset's statistical summary.
     **Tool**: `df.describe()` → `<DataFrame>`
-    **Response**: Here are the summary statistics for the numeric columns.
-
-3.  **User**: Which values are most common in the gender column?
+    **Response**: Here are the summary statistics for the numeric columns.""",
+    ),
+    (
+        ("gender",),
+        """**User**: Which values are most common in the gender column?
     **Tool**: `df['gender'].value_counts()` → `<Series>`
-    **Response**: These are the most frequent values in the gender column.
-
-4.  **User**: Are there any missing values in the income column?
+    **Response**: These are the most frequent values in the gender column.""",
+    ),
+    (
+        ("income",),
+        """**User**: Are there any missing values in the income column?
     **Tool**: `df['income'].isnull().sum()` → `12`
-    **Response**: Yes, there are 12 missing values in the income column.
-
-5.  **User**: Show all rows where age is greater than 50.
+    **Response**: Yes, there are 12 missing values in the income column.""",
+    ),
+    (
+        ("age",),
+        """**User**: Show all rows where age is greater than 50.
     **Tool**: `df[df['age'] > 50]` → `<DataFrame>`
-    **Response**: Here are the rows for people older than 50.
-
-6.  **User**: Plot a histogram of the 'age' column.
+    **Response**: Here are the rows for people older than 50.""",
+    ),
+    (
+        ("age",),
+        """**User**: Plot a histogram of the 'age' column.
     **Tool**: `df['age'].plot(kind='hist').figure` → `<Figure>`
-    **Response**: Here is a histogram of the 'age' column.
-
-7.  **User**: Can you show me a bar chart of the 'gender' counts?
+    **Response**: Here is a histogram of the 'age' column.""",
+    ),
+    (
+        ("gender",),
+        """**User**: Can you show me a bar chart of the 'gender' counts?
     **Tool**: `df['gender'].value_counts().plot(kind='bar').figure` → `<Figure>`
-    **Response**: Here's a bar chart showing the distribution of genders.
-
-8.  **User**: Create a scatter plot of 'income' vs 'age'.
+    **Response**: Here's a bar chart showing the distribution of genders.""",
+    ),
+    (
+        ("income", "age"),
+        """**User**: Create a scatter plot of 'income' vs 'age'.
     **Tool**: `df.plot.scatter(x='income', y='age').figure` → `<Figure>`
-    **Response**: Here is a scatter plot of income versus age.
-
-9.  **User**: Generate a box plot for 'salary'.
+    **Response**: Here is a scatter plot of income versus age.""",
+    ),
+    (
+        ("salary",),
+        """**User**: Generate a box plot for 'salary'.
     **Tool**: `df['salary'].plot(kind='box').figure` → `<Figure>`
-    **Response**: Here is the box plot for salary.
-
-10. **User**: Plot the distribution of 'score' using a density plot.
+    **Response**: Here is the box plot for salary.""",
+    ),
+    (
+        ("score",),
+        """**User**: Plot the distribution of 'score' using a density plot.
     **Tool**: `df['score'].plot(kind='density').figure` → `<Figure>`
-    **Response**: Here's a density plot for the 'score' column.
+    **Response**: Here's a density plot for the 'score' column.""",
+    ),
+)
 
------------------
+_SYSTEM_PROMPT_SCHEMA_HEADER = """-----------------
 DataFrame Schema:
-{dataframe_schema}
------------------
 """
+_SYSTEM_PROMPT_TAIL = "\n-----------------\n"
+
+
+@functools.lru_cache(maxsize=8)
+def get_system_prompt(dataframe_schema: str, columns: Tuple[str, ...] = ()) -> str:
+    """Get system prompt for the agent, keeping only examples that reference the given columns."""
+    available_columns = set(columns)
+    query_examples = [
+        f'{description}: "{query}"'
+        for example_columns, description, query in _QUERY_EXAMPLES
+        if available_columns.issuperset(example_columns)
+    ]
+    end_to_end_examples = [
+        example
+        for example_columns, example in _END_TO_END_EXAMPLES
+        if available_columns.issuperset(example_columns)
+    ]
+    return "".join(
+        (
+            _SYSTEM_PROMPT_HEAD,
+            "".join(f"    - {example}\n" for example in query_examples),
+            _SYSTEM_PROMPT_EXAMPLES_HEADER,
+            "".join(
+                f"{f'{i}.':<4}{example}\n\n"
+                for i, example in enumerate(end_to_end_examples, start=1)
+            ),
+            _SYSTEM_PROMPT_SCHEMA_HEADER,
+            dataframe_schema,
+            _SYSTEM_PROMPT_TAIL,
+        )
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def build_graph():
+    """Builds and compiles the agent graph, shared by all Agent instances.
+
+    The graph does not depend on the DataFrame: the tool reads it from the
+    run's `configurable` config, so the graph is compiled once per process.
+    """
+
+    # The docstring is the tool description sent to the model. The tool returns
+    # the content and an optional artifact ID; the artifact (DataFrame, Series,
+    # or Figure rendered as PNG bytes) is stored in the run's artifact registry
+    # under that ID, together with the full row count if a DataFrame or Series
+    # was truncated.
+    @tool(response_format="content_and_artifact")
+    def run_dataframe_query(
+        query: str,
+        config: RunnableConfig,
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Executes a Python query on a pandas DataFrame.
+        Returns a textual description of the result. DataFrames, Series and figures are shown to the user separately.
+        """
+        query_results = config["configurable"].get("query_results")
+        try:
+            if query_results is not None and query in query_results:
+                content, artifact, total_rows = query_results[query]
+                logger.info(
+                    "Tool 'run_dataframe_query': Reusing the result of query '%s'.",
+                    query,
+                )
+            else:
+                df = config["configurable"]["df"]
+                resolved_query, corrections = resolve_column_aliases(
+                    query, tuple(df.columns)
+                )
+                result = evaluate_query(df, resolved_query)
+                artifact = total_rows = None
+
+                if isinstance(result, (pd.DataFrame, pd.Series)):
+                    content = f"Query '{query}' returned {describe_result(result)}."
+                    artifact = result
+                    if len(result) > MAX_ARTIFACT_ROWS:
+                        content += f" Showing the first {MAX_ARTIFACT_ROWS} of {len(result)} rows."
+                        artifact = result.head(MAX_ARTIFACT_ROWS)
+                        total_rows = len(result)
+                elif isinstance(result, matplotlib.figure.Figure):
+                    content = (
+                        f"Query '{query}' returned an artifact of type {type(result)}."
+                    )
+                    artifact = render_figure(result)
+                else:
+                    content = f"Query '{query}' returned: {describe_result(result)}."
+                if corrections:
+                    corrected = ", ".join(
+                        f"'{alias}' -> '{column}'" for alias, column in corrections
+                    )
+                    content += f" Corrected column names: {corrected}. Use the exact names in later queries."
+                logger.info("Tool 'run_dataframe_query': %s", content)
+                if (
+                    query_results is not None
+                    and len(query_results) < QUERY_RESULT_CACHE_SIZE
+                ):
+                    query_results[query] = (content, artifact, total_rows)
+            if artifact is None:
+                return content, None
+            artifact_id = uuid.uuid4().hex
+            config["configurable"]["artifacts"][artifact_id] = (artifact, total_rows)
+            return content, artifact_id
+        except Exception as e:
+            error_message = f"{QUERY_ERROR_PREFIX} '{query}': {str(e)}"
+            logger.error(
+                "Tool Node 'run_dataframe_query': %s",
+                error_message,
+                exc_info=logger.isEnabledFor(logging.DEBUG),
+            )
+            return error_message, None
+
+    tools = [run_dataframe_query]
+    tool_node = ToolNode(tools)
+    model = ChatGoogleGenerativeAI(model="gemini-2.5-flash").bind_tools(tools)
+
+    def attach_artifact(state: MessagesState, config: RunnableConfig, response):
+        if state["messages"] and isinstance(state["messages"][-1], ToolMessage):
+            last_tool_message = state["messages"][-1]
+            if last_tool_message.artifact is not None:
+                artifact, total_rows = config["configurable"]["artifacts"].pop(
+                    last_tool_message.artifact, (None, None)
+                )
+                response.additional_kwargs = response.additional_kwargs or {}
+                key = get_artifact_key(artifact)
+                if key:
+                    response.additional_kwargs[key] = artifact
+                    if total_rows is not None:
+                        response.additional_kwargs["dataframe_artifact_total_rows"] = (
+                            total_rows
+                        )
+                    logger.info(
+                        "Agent Node: Attached %s artifact to AIMessage.", type(artifact)
+                    )
+                else:
+                    logger.warning(
+                        "Agent Node: Unrecognized artifact type: %s", type(artifact)
+                    )
+            else:
+                logger.info("Agent Node: ToolMessage returned no artifact.")
+
+        return {"messages": [response]}
+
+    def get_model_input(state: MessagesState, config: RunnableConfig):
+        messages = trim_history(state["messages"])
+        system_message = config["configurable"].get("system_message")
+        if system_message is not None and not (
+            messages and isinstance(messages[0], SystemMessage)
+        ):
+            messages = [system_message, *messages]
+        return messages
+
+    def agent_node(state: MessagesState, config: RunnableConfig):
+        response = model.invoke(get_model_input(state, config), config)
+        return attach_artifact(state, config, response)
+
+    async def aagent_node(state: MessagesState, config: RunnableConfig):
+        response = await model.ainvoke(get_model_input(state, config), config)
+        return attach_artifact(state, config, response)
+
+    def should_continue(state: MessagesState):
+        last_message = state["messages"][-1]
+        if not isinstance(last_message, AIMessage):
+            logger.error(
+                "Router Node: Expected AIMessage, got %s. Content: '%s'. Ending graph.",
+                type(last_message),
+                last_message.content,
+            )
+            return END
+
+        if last_message.tool_calls:
+            tool_name = last_message.tool_calls[0]["name"]
+            tool_args = last_message.tool_calls[0]["args"]
+            logger.info(
+                "Router Node: AI requests tool '%s' with args: %s.",
+                tool_name,
+                tool_args,
+            )
+            return "tools"
+        else:
+            logger.info(
+                "Router Node: AI provided final response. Content: '%s'. Ending graph.",
+                last_message.content,
+            )
+            return END
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("agent", RunnableLambda(agent_node, afunc=aagent_node))
+    builder.add_node("tools", tool_node)
+    builder.add_edge(START, "agent")
+    builder.add_conditional_edges(
+        "agent",
+        should_continue,
+        {"tools": "tools", END: END},
+    )
+    builder.add_edge("tools", "agent")
+
+    try:
+        graph = builder.compile()
+        logger.info("Graph compiled successfully.")
+        return graph
+    except Exception as e:
+        logger.error(f"Graph compilation failed. Error: {e}", exc_info=True)
+        raise
 
 
 class Agent:
 
     def __init__(self, df: pd.DataFrame):
         self.df = df
-        self.model = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
         self.messages: List[Union[AIMessage, HumanMessage, SystemMessage]] = []
+        self.artifacts: Dict[str, Tuple[Any, Optional[int]]] = {}
         self._initialize_state()
-        self.graph = self._build_graph()
+        self.graph = build_graph()
 
     def _initialize_state(self):
         """Initializes the agent's message state."""
-        dataframe_schema = get_dataframe_schema(self.df)
-        system_prompt = get_system_prompt(dataframe_schema)
-        self.messages.append(SystemMessage(content=system_prompt))
+        dataframe_schema = get_dataframe_schema_cached(self.df)
+        system_prompt = get_system_prompt(
+            dataframe_schema, tuple(map(str, self.df.columns))
+        )
+        self.system_message = SystemMessage(content=system_prompt)
+        self.messages.append(self.system_message)
         self.messages.append(
             AIMessage(
                 content="Hi! I'm DataBot. Feel free to ask me anything about this dataset."
@@ -123,117 +915,168 @@ class Agent:
         )
         logger.info("Agent state initialized with system prompt and welcome message.")
 
-    def _build_graph(self):
-        @tool(response_format="content_and_artifact")
-        def run_dataframe_query(
-            query: str,
-        ) -> Tuple[
-            str, Optional[Union[pd.DataFrame, pd.Series, matplotlib.figure.Figure]]
-        ]:
-            """
-            Executes a Python query on a pandas DataFrame.
-            Returns a tuple containing a textual description and an optional artifact (DataFrame, Series, or Figure).
-            """
-            try:
-                result = eval(query, {"df": self.df, "pd": pd}, {})
-                artifact = None
-
-                if isinstance(
-                    result, (pd.DataFrame, pd.Series, matplotlib.figure.Figure)
-                ):
-                    content = (
-                        f"Query '{query}' returned an artifact of type {type(result)}."
-                    )
-                    artifact = result
-                else:
-                    content = f"Query '{query}' returned: {str(result)}."
-                logger.info(f"Tool 'run_dataframe_query': {content}")
-                return content, artifact
-            except Exception as e:
-                error_message = f"Error executing query '{query}': {str(e)}"
-                logger.error(
-                    f"Tool Node 'run_dataframe_query': {error_message}", exc_info=True
-                )
-                return error_message, None
-
-        tools = [run_dataframe_query]
-        tool_node = ToolNode(tools)
-        self.model = self.model.bind_tools(tools)
-
-        def agent_node(state: MessagesState):
-            config = {"callbacks": [langfuse_callback_handler]}
-            response = self.model.invoke(state["messages"], config)
-
-            if state["messages"] and isinstance(state["messages"][-1], ToolMessage):
-                last_tool_message = state["messages"][-1]
-                if last_tool_message.artifact is not None:
-                    artifact = last_tool_message.artifact
-                    response.additional_kwargs = response.additional_kwargs or {}
-                    key = None
-                    if isinstance(artifact, (pd.DataFrame, pd.Series)):
-                        key = "dataframe_artifact"
-                    elif isinstance(artifact, matplotlib.figure.Figure):
-                        key = "figure_artifact"
-                    if key:
-                        response.additional_kwargs[key] = artifact
-                        logger.info(
-                            f"Agent Node: Attached {type(artifact)} artifact to AIMessage."
-                        )
-                    else:
-                        logger.warning(
-                            f"Agent Node: Unrecognized artifact type: {type(artifact)}"
-                        )
-                else:
-                    logger.info("Agent Node: ToolMessage returned no artifact.")
+    def get_messages(self) -> List[Union[AIMessage, HumanMessage, SystemMessage]]:
+        """Returns the current list of messages."""
+        return self.messages
 
-            return {"messages": [response]}
+    def _get_config(self) -> RunnableConfig:
+        return {
+            "callbacks": [langfuse_callback_handler],
+            "configurable": {
+                "df": self.df,
+                "artifacts": self.artifacts,
+                "query_results": {},
+                "system_message": self.system_message,
+            },
+        }
 
-        def should_continue(state: MessagesState):
-            last_message = state["messages"][-1]
-            if not isinstance(last_message, AIMessage):
-                logger.error(
-                    f"Router Node: Expected AIMessage, got {type(last_message)}. Content: '{last_message.content}'. Ending graph."
-                )
-                return END
+    @functools.cached_property
+    def fingerprint(self) -> Optional[str]:
+        """Content hash of the DataFrame used to key cached responses."""
+        return get_dataframe_fingerprint(self.df)
 
-            if last_message.tool_calls:
-                tool_name = last_message.tool_calls[0]["name"]
-                tool_args = last_message.tool_calls[0]["args"]
-                logger.info(
-                    f"Router Node: AI requests tool '{tool_name}' with args: {tool_args}."
-                )
-                return "tools"
-            else:
-                logger.info(
-                    f"Router Node: AI provided final response. Content: '{last_message.content}'. Ending graph."
-                )
-                return END
-
-        builder = StateGraph(MessagesState)
-        builder.add_node("agent", agent_node)
-        builder.add_node("tools", tool_node)
-        builder.add_edge(START, "agent")
-        builder.add_conditional_edges(
-            "agent",
-            should_continue,
-            {"tools": "tools", END: END},
-        )
-        builder.add_edge("tools", "agent")
+    def _start_turn(
+        self, user_query: str
+    ) -> Tuple[Optional[Tuple[str, str, str]], Optional[List[BaseMessage]]]:
+        """Appends the user's query and, if the model can be skipped, the response messages.
 
-        try:
-            graph = builder.compile()
-            logger.info("Graph compiled successfully.")
-            return graph
-        except Exception as e:
-            logger.error(f"Graph compilation failed. Error: {e}", exc_info=True)
-            raise
+        Questions about the DataFrame's structure are answered directly. Other
+        responses come from the response cache, keyed on the DataFrame content,
+        the previous user query and the current one, so follow-up questions are
+        only reused in the same context.
+        """
+        self.artifacts.clear()
+        fast_path_answer = get_fast_path_answer(self.df, user_query)
+        if fast_path_answer is not None:
+            logger.info("Agent: Answered query '%s' without the model.", user_query)
+            response_messages = [AIMessage(content=fast_path_answer)]
+            self.messages.append(HumanMessage(content=user_query))
+            self.messages.extend(response_messages)
+            return None, response_messages
 
-    def get_messages(self) -> List[Union[AIMessage, HumanMessage, SystemMessage]]:
-        """Returns the current list of messages."""
-        return self.messages
+        key = None
+        cached_messages = None
+        if self.fingerprint is not None:
+            previous_query = next(
+                (
+                    m.content
+                    for m in reversed(self.messages)
+                    if isinstance(m, HumanMessage)
+                ),
+                "",
+            )
+            key = (
+                self.fingerprint,
+                normalize_query(previous_query),
+                normalize_query(user_query),
+            )
+            with _response_cache_lock:
+                cached_messages = _response_cache.get(key)
+                if cached_messages is not None:
+                    _response_cache.move_to_end(key)
+
+        self.messages.append(HumanMessage(content=user_query))
+        if cached_messages is not None:
+            logger.info("Agent: Response cache hit for query '%s'.", user_query)
+            # add_messages merges messages by ID, so replayed messages need new ones.
+            cached_messages = [
+                m.model_copy(update={"id": str(uuid.uuid4())}) for m in cached_messages
+            ]
+            self.messages.extend(cached_messages)
+        return key, cached_messages
+
+    def _finish_turn(self, key: Optional[Tuple[str, str, str]], turn_start: int):
+        """Caches the messages produced for the turn if it ended with a usable final AI response.
+
+        Turns whose last query failed or whose final response has neither
+        content nor an artifact are not cached, so asking again retries them.
+        """
+        new_messages = self.messages[turn_start:]
+        if (
+            key is None
+            or not new_messages
+            or not isinstance(new_messages[-1], AIMessage)
+            or new_messages[-1].tool_calls
+        ):
+            return
+        final_message = new_messages[-1]
+        if not str(final_message.content).strip() and _ARTIFACT_KWARGS.isdisjoint(
+            final_message.additional_kwargs
+        ):
+            return
+        last_tool_message = next(
+            (m for m in reversed(new_messages) if isinstance(m, ToolMessage)), None
+        )
+        if last_tool_message is not None and str(last_tool_message.content).startswith(
+            QUERY_ERROR_PREFIX
+        ):
+            return
+        with _response_cache_lock:
+            _response_cache[key] = new_messages
+            _response_cache.move_to_end(key)
+            if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
 
     def invoke(self, user_query: str):
         """Runs the agent with the user's query and updates the internal state."""
-        self.messages.append(HumanMessage(content=user_query))
-        response = self.graph.invoke({"messages": self.messages})
+        key, cached_messages = self._start_turn(user_query)
+        if cached_messages is not None:
+            return
+        turn_start = len(self.messages)
+        response = self.graph.invoke({"messages": self.messages}, self._get_config())
+        self.messages = response["messages"]
+        self._finish_turn(key, turn_start)
+
+    def stream(self, user_query: str) -> Iterator[str]:
+        """Runs the agent with the user's query, yielding response text as it is generated, and updates the internal state."""
+        key, cached_messages = self._start_turn(user_query)
+        if cached_messages is not None:
+            if cached_messages[-1].content:
+                yield cached_messages[-1].content
+            return
+        turn_start = len(self.messages)
+        for stream_mode, chunk in self.graph.stream(
+            {"messages": self.messages},
+            self._get_config(),
+            stream_mode=["messages", "values"],
+        ):
+            if stream_mode == "values":
+                self.messages = chunk["messages"]
+                continue
+            text = get_stream_text(*chunk)
+            if text:
+                yield text
+        self._finish_turn(key, turn_start)
+
+    async def astream(self, user_query: str) -> AsyncIterator[str]:
+        """Asynchronously runs the agent with the user's query, yielding response text as it is generated, and updates the internal state."""
+        key, cached_messages = self._start_turn(user_query)
+        if cached_messages is not None:
+            if cached_messages[-1].content:
+                yield cached_messages[-1].content
+            return
+        turn_start = len(self.messages)
+        async for stream_mode, chunk in self.graph.astream(
+            {"messages": self.messages},
+            self._get_config(),
+            stream_mode=["messages", "values"],
+        ):
+            if stream_mode == "values":
+                self.messages = chunk["messages"]
+                continue
+            text = get_stream_text(*chunk)
+            if text:
+                yield text
+        self._finish_turn(key, turn_start)
+
+    async def ainvoke(self, user_query: str):
+        """Asynchronously runs the agent with the user's query and updates the internal state."""
+        key, cached_messages = self._start_turn(user_query)
+        if cached_messages is not None:
+            return
+        turn_start = len(self.messages)
+        response = await self.graph.ainvoke(
+            {"messages": self.messages}, self._get_config()
+        )
         self.messages = response["messages"]
+        self._finish_turn(key, turn_start)
@@ -1,4 +1,6 @@
+import io
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 import matplotlib.figure
 import matplotlib.pyplot as plt
@@ -6,10 +8,14 @@ import pandas as pd
 import streamlit as st
 from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
 
-from agent import Agent
+from agent import Agent, build_graph, throttle_stream
 
 logger = logging.getLogger(__name__)
 
+HISTORY_PREVIEW_ROWS = 200
+
+CSV_CACHE_MAX_ENTRIES = 4
+
 
 plt.style.use("dark_background")
 
@@ -24,19 +30,43 @@ st.markdown(
 st.session_state.setdefault("dataframe", None)
 st.session_state.setdefault("agent", None)
 st.session_state.setdefault("current_file_name", None)
+st.session_state.setdefault("current_file_id", None)
+
+
+@st.cache_data(show_spinner=False, max_entries=CSV_CACHE_MAX_ENTRIES)
+def read_csv(file_bytes: bytes) -> pd.DataFrame:
+    try:
+        return pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+    except Exception as e:
+        logger.warning(
+            f"File Uploader: PyArrow CSV engine failed, falling back to default engine. Error: {e}"
+        )
+        return pd.read_csv(io.BytesIO(file_bytes))
+
+
+def read_csv_preview(file_bytes: bytes, nrows: int = 5) -> pd.DataFrame:
+    return pd.read_csv(io.BytesIO(file_bytes), nrows=nrows)
+
+
+@st.cache_resource(show_spinner=False)
+def start_graph_warm_up() -> Future:
+    return ThreadPoolExecutor(max_workers=1).submit(build_graph)
 
 
 def reset_session_state():
     st.session_state.dataframe = None
     st.session_state.agent = None
     st.session_state.current_file_name = None
+    st.session_state.current_file_id = None
 
 
-def initialize_agent(df: pd.DataFrame, file_name: str):
+def initialize_agent(df: pd.DataFrame, file_name: str, file_id: str):
     logger.info(f"Agent: Attempting initialization for file '{file_name}'.")
     try:
+        wait([start_graph_warm_up()])
         st.session_state.agent = Agent(df)
         st.session_state.current_file_name = file_name
+        st.session_state.current_file_id = file_id
         logger.info(f"Agent: Initialization successful for file '{file_name}'.")
     except Exception as e:
         logger.error(
@@ -47,23 +77,31 @@ def initialize_agent(df: pd.DataFrame, file_name: str):
         reset_session_state()
 
 
+# Compile the agent graph while the user picks a file.
+start_graph_warm_up()
+
 with st.sidebar:
     st.header("Upload your CSV file")
     uploaded_file = st.file_uploader("Choose a CSV file", type=["csv"])
 
     if uploaded_file is not None:
         if (
-            st.session_state.current_file_name != uploaded_file.name
+            st.session_state.current_file_id != uploaded_file.file_id
             or st.session_state.agent is None
         ):
             logger.info(f"File Uploader: New file '{uploaded_file.name}' selected.")
             try:
-                df = pd.read_csv(uploaded_file)
+                file_bytes = uploaded_file.getvalue()
+                preview_placeholder = st.empty()
+                preview_placeholder.dataframe(read_csv_preview(file_bytes), height=200)
+                with st.spinner("Loading CSV..."):
+                    df = read_csv(file_bytes)
+                preview_placeholder.empty()
                 st.session_state.dataframe = df
                 logger.info(
                     f"File Uploader: CSV '{uploaded_file.name}' read successfully. Shape: {df.shape}"
                 )
-                initialize_agent(df, uploaded_file.name)
+                initialize_agent(df, uploaded_file.name, uploaded_file.file_id)
             except Exception as e:
                 logger.error(
                     f"File Uploader: Reading or processing CSV '{uploaded_file.name}' failed. Error: {e}",
@@ -74,7 +112,7 @@ with st.sidebar:
 
         if (
             st.session_state.dataframe is not None
-            and st.session_state.current_file_name == uploaded_file.name
+            and st.session_state.current_file_id == uploaded_file.file_id
         ):
             st.success(f"CSV uploaded successfully.")
             st.header("Data Preview")
@@ -97,16 +135,19 @@ with st.sidebar:
 
 
 if st.session_state.agent:
-    for message in st.session_state.agent.get_messages():
+    for index, message in enumerate(st.session_state.agent.get_messages()):
         if isinstance(message, (SystemMessage, ToolMessage)):
             continue
 
+        has_content = bool(message.content.strip())
+        dataframe_artifact = figure_artifact = total_rows = None
         if isinstance(message, AIMessage):
+            dataframe_artifact = message.additional_kwargs.get("dataframe_artifact")
+            total_rows = message.additional_kwargs.get("dataframe_artifact_total_rows")
+            figure_artifact = message.additional_kwargs.get("figure_artifact")
             is_tool_call = bool(message.tool_calls)
-            has_content = bool(message.content.strip())
             has_artifacts = (
-                "dataframe_artifact" in message.additional_kwargs
-                or "figure_artifact" in message.additional_kwargs
+                dataframe_artifact is not None or figure_artifact is not None
             )
 
             if is_tool_call and not has_content and not has_artifacts:
@@ -118,18 +159,30 @@ if st.session_state.agent:
                 continue
 
         with st.chat_message(message.type):
-            if message.content.strip():
+            if has_content:
                 st.write(message.content)
 
-            if isinstance(message, AIMessage):
-                if "dataframe_artifact" in message.additional_kwargs:
-                    dataframe_artifact = message.additional_kwargs["dataframe_artifact"]
-                    if isinstance(dataframe_artifact, (pd.DataFrame, pd.Series)):
-                        st.dataframe(dataframe_artifact)
-                if "figure_artifact" in message.additional_kwargs:
-                    figure_artifact = message.additional_kwargs["figure_artifact"]
-                    if isinstance(figure_artifact, matplotlib.figure.Figure):
-                        st.pyplot(figure_artifact)
+            if isinstance(dataframe_artifact, (pd.DataFrame, pd.Series)):
+                num_rows = len(dataframe_artifact)
+                toggle_label = (
+                    f"Show all {num_rows} rows"
+                    if total_rows is None
+                    else f"Show the first {num_rows} rows"
+                )
+                show_all_rows = num_rows <= HISTORY_PREVIEW_ROWS or st.toggle(
+                    toggle_label, key=f"show_all_rows_{index}"
+                )
+                if not show_all_rows:
+                    dataframe_artifact = dataframe_artifact.head(HISTORY_PREVIEW_ROWS)
+                st.dataframe(dataframe_artifact)
+                if total_rows is not None:
+                    st.caption(
+                        f"The query returned {total_rows} rows; only the first {num_rows} were kept."
+                    )
+            if isinstance(figure_artifact, bytes):
+                st.image(figure_artifact)
+            elif isinstance(figure_artifact, matplotlib.figure.Figure):
+                st.pyplot(figure_artifact)
 
 
 if user_query := st.chat_input("Ask something about your data..."):
@@ -146,27 +199,36 @@ if user_query := st.chat_input("Ask something about your data..."):
 
         with st.spinner("Thinking..."):
             try:
-                st.session_state.agent.invoke(user_query)
+                with st.chat_message("ai"):
+                    st.write_stream(
+                        throttle_stream(st.session_state.agent.stream(user_query))
+                    )
 
                 ai_message = st.session_state.agent.get_messages()[-1]
-                if isinstance(ai_message, AIMessage):
+                if isinstance(ai_message, AIMessage) and logger.isEnabledFor(
+                    logging.DEBUG
+                ):
                     if ai_message.content:
-                        logger.info(
-                            f"Chat Response: Agent content received: '{str(ai_message.content)}'"
+                        logger.debug(
+                            "Chat Response: Agent content received: '%s'",
+                            ai_message.content,
                         )
                     if "dataframe_artifact" in ai_message.additional_kwargs:
                         dataframe_artifact = ai_message.additional_kwargs[
                             "dataframe_artifact"
                         ]
-                        logger.info(
-                            f"Chat Response: Agent artifact received. Type: {type(dataframe_artifact)}, Shape: {getattr(dataframe_artifact, 'shape', 'N/A')}"
+                        logger.debug(
+                            "Chat Response: Agent artifact received. Type: %s, Shape: %s",
+                            type(dataframe_artifact),
+                            getattr(dataframe_artifact, "shape", "N/A"),
                         )
                     if "figure_artifact" in ai_message.additional_kwargs:
                         figure_artifact = ai_message.additional_kwargs[
                             "figure_artifact"
                         ]
-                        logger.info(
-                            f"Chat Response: Agent artifact received. Type: {type(figure_artifact)}"
+                        logger.debug(
+                            "Chat Response: Agent artifact received. Type: %s",
+                            type(figure_artifact),
                         )
                 st.rerun()
 
@@ -0,0 +1,34 @@
+import pandas as pd
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.agent import strip_artifacts
+
+
+def test_strip_artifacts_removes_artifacts_from_nested_messages():
+    """
+    Tests that artifacts are removed from messages nested in chain and chat model payloads without mutating the originals.
+    """
+    dataframe = pd.DataFrame({"a": [1, 2]})
+    ai_message = AIMessage(
+        content="Here it is.",
+        additional_kwargs={"dataframe_artifact": dataframe, "other": 1},
+    )
+    human_message = HumanMessage(content="Show me the data.")
+
+    stripped_inputs = strip_artifacts({"messages": [human_message, ai_message]})
+    stripped_batches = strip_artifacts([[human_message, ai_message]])
+
+    for stripped_messages in (stripped_inputs["messages"], stripped_batches[0]):
+        assert stripped_messages[0] is human_message
+        assert stripped_messages[1].content == "Here it is."
+        assert stripped_messages[1].additional_kwargs == {"other": 1}
+    assert ai_message.additional_kwargs["dataframe_artifact"] is dataframe
+
+
+def test_strip_artifacts_leaves_other_payloads_unchanged():
+    """
+    Tests that payloads without messages are returned as they are.
+    """
+    assert strip_artifacts("text") == "text"
+    assert strip_artifacts({"query": "df.head()"}) == {"query": "df.head()"}
+    assert strip_artifacts((1, 2)) == (1, 2)
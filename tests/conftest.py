@@ -0,0 +1,16 @@
+import pandas as pd
+import pytest
+
+from src.agent import Agent
+
+
+@pytest.fixture(scope="session")
+def iris_df() -> pd.DataFrame:
+    """The Iris dataset, read once per test session."""
+    return pd.read_csv("tests/data/iris.csv")
+
+
+@pytest.fixture
+def iris_agent(iris_df: pd.DataFrame) -> Agent:
+    """A fresh agent over the Iris dataset, sharing the process-wide compiled graph."""
+    return Agent(iris_df)
@@ -0,0 +1,47 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from src.agent import trim_history
+
+
+def make_turns(count: int) -> list:
+    messages = []
+    for i in range(count):
+        messages.append(HumanMessage(content=f"Question {i}"))
+        messages.append(AIMessage(content=f"Answer {i}"))
+    return messages
+
+
+def test_trim_history_keeps_system_message_and_last_turns():
+    """
+    Tests that only the last `max_turns` user turns are kept after the leading system message.
+    """
+    system_message = SystemMessage(content="System prompt")
+    messages = [system_message, *make_turns(5)]
+
+    trimmed = trim_history(messages, max_turns=2)
+
+    assert trimmed[0] is system_message
+    assert [m.content for m in trimmed[1:]] == [
+        "Question 3",
+        "Answer 3",
+        "Question 4",
+        "Answer 4",
+    ]
+
+
+def test_trim_history_returns_short_history_unchanged():
+    """
+    Tests that histories within the turn limit are returned as they are.
+    """
+    messages = make_turns(2)
+
+    assert trim_history(messages, max_turns=2) is messages
+
+
+def test_trim_history_without_system_message():
+    """
+    Tests that histories without a system message keep just the recent turns.
+    """
+    trimmed = trim_history(make_turns(3), max_turns=1)
+
+    assert [m.content for m in trimmed] == ["Question 2", "Answer 2"]
@@ -0,0 +1,59 @@
+import pytest
+
+from src.agent import resolve_column_aliases
+
+COLUMNS = ("sepal_length", "sepal_width", "Petal Length", "species")
+
+
+@pytest.mark.parametrize(
+    "query, expected_query, expected_corrections",
+    [
+        (
+            "df['Sepal_Length']",
+            "df['sepal_length']",
+            (("Sepal_Length", "sepal_length"),),
+        ),
+        (
+            "df['sepal length']",
+            "df['sepal_length']",
+            (("sepal length", "sepal_length"),),
+        ),
+        ("df['sepal-width']", "df['sepal_width']", (("sepal-width", "sepal_width"),)),
+        (
+            "df['petal_length'].mean()",
+            "df['Petal Length'].mean()",
+            (("petal_length", "Petal Length"),),
+        ),
+        (
+            "df[['Sepal Length', 'SPECIES']]",
+            "df[['sepal_length', 'species']]",
+            (("Sepal Length", "sepal_length"), ("SPECIES", "species")),
+        ),
+    ],
+)
+def test_resolve_column_aliases_corrects_column_variants(
+    query: str, expected_query: str, expected_corrections: tuple
+):
+    """
+    Tests that column names differing only in case, spaces or hyphens are corrected in df['col'] and df[[...]].
+    """
+    resolved_query, corrections = resolve_column_aliases(query, COLUMNS)
+
+    assert resolved_query == expected_query
+    assert corrections == expected_corrections
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "df['sepal_length'].mean()",
+        "df[['Petal Length', 'species']]",
+        "df['unknown_column']",
+        "df.groupby('species').size()",
+    ],
+)
+def test_resolve_column_aliases_leaves_other_queries_unchanged(query: str):
+    """
+    Tests that exact column names, unknown names and names outside df[...] are left as written.
+    """
+    assert resolve_column_aliases(query, COLUMNS) == (query, ())
@@ -0,0 +1,28 @@
+import pandas as pd
+
+from src.agent import MAX_RESULT_CHARS, describe_result
+
+
+def test_describe_result_truncates_long_text():
+    """
+    Tests that long text results, such as CSV exports, are truncated for the tool message.
+    """
+    df = pd.DataFrame({"value": range(10_000)})
+    text = df.to_csv()
+
+    description = describe_result(text)
+
+    assert description.startswith(text[:MAX_RESULT_CHARS])
+    assert len(description) < MAX_RESULT_CHARS + 100
+    assert str(len(text)) in description
+
+
+def test_describe_result_keeps_short_results():
+    """
+    Tests that short scalar results and DataFrame summaries are returned unchanged.
+    """
+    assert describe_result(42) == "42"
+    assert describe_result("setosa") == "setosa"
+    assert (
+        describe_result(pd.DataFrame({"a": [1, 2]})) == "a DataFrame with shape (2, 1)"
+    )
@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from src.agent import get_fast_path_answer
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame({"name": ["a", "b", "c"], "value": [1, 2, 3]})
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["What are the column names?", "columns", "list the columns in the dataset"],
+)
+def test_fast_path_lists_columns(df: pd.DataFrame, query: str):
+    """
+    Tests that column questions are answered with the DataFrame's columns.
+    """
+    assert (
+        get_fast_path_answer(df, query)
+        == "The DataFrame contains the columns: name, value."
+    )
+
+
+@pytest.mark.parametrize("query", ["How many rows are there?", "row count"])
+def test_fast_path_counts_rows(df: pd.DataFrame, query: str):
+    """
+    Tests that row count questions are answered with the DataFrame's length.
+    """
+    assert get_fast_path_answer(df, query) == "The DataFrame has 3 rows."
+
+
+def test_fast_path_lists_dtypes(df: pd.DataFrame):
+    """
+    Tests that data type questions are answered with each column's dtype.
+    """
+    answer = get_fast_path_answer(df, "What are the data types?")
+
+    assert answer.startswith("The column data types are:")
+    assert "- value: int64" in answer
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "How many rows have a value above 1?",
+        "Which columns have missing values?",
+        "Plot the value column",
+    ],
+)
+def test_fast_path_leaves_other_questions_to_the_model(df: pd.DataFrame, query: str):
+    """
+    Tests that questions needing analysis are not answered by a fast path.
+    """
+    assert get_fast_path_answer(df, query) is None
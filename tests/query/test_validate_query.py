@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from src.agent import evaluate_query, parse_query, validate_query
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "df.head()",
+        "df[df['age'] > 30]",
+        "df['gender'].value_counts()",
+        "df.describe()",
+        "df['income'].isnull().sum()",
+        "list(df.columns)",
+        "df.groupby('gender')['income'].mean()",
+        "df.groupby('gender').agg(total=('income', 'sum'))",
+        "df.agg({'age': ['mean', 'max']})",
+        "df.agg('mean', numeric_only=True)",
+        "df.groupby('gender')['age'].transform(lambda s: s - s.mean())",
+        "df['gender'].map({'M': 'Male'})",
+        "df.apply(lambda row: row['age'] * 2, axis=1)",
+        "[column for column in df.columns if column.startswith('a')]",
+        "df['age'].plot(kind='hist').figure",
+        "df.to_csv()",
+        "df.to_string(index=False)",
+    ],
+)
+def test_validate_query_accepts_common_queries(query: str):
+    """
+    Tests that typical pandas queries written by the model pass validation.
+    """
+    validate_query(parse_query(query))
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "'{0.__init__.__globals__[sys].modules[os].environ[MYSECRET]}'.format(df)",
+        "'{0}'.format_map(df)",
+        "str.format('{0.__class__}', df)",
+        "pd.io.parsers.TextFileReader('/tmp/secret.csv').read()",
+        "pd.read_csv('/tmp/secret.csv')",
+        "df.plot().figure.savefig('/tmp/plot.png')",
+        "df.to_csv('/tmp/out.csv')",
+        "df.to_json(path_or_buf='/tmp/out.json')",
+        "df.to_csv(**{'path_or_buf': '/tmp/out.csv'})",
+        "df.to_pickle('/tmp/out.pkl')",
+        "df.apply(pd.Series.to_csv, args=('/tmp/out.csv',))",
+        "df.agg('to_pickle', '/tmp/out.pkl')",
+        "df.apply(str('to_pickle'), args=('/tmp/pwn3.pkl',))",
+        "[df.apply(f, args=('/tmp/pwn6.pkl',)) for f in ['to_pickle']]",
+        "df.apply('to_' + 'pickle', args=('/tmp/out.pkl',))",
+        "df.apply('to_pickle' if len(df) else 'sum', args=('/tmp/out.pkl',))",
+        "df.apply(''.join(['to_', 'pickle']), args=('/tmp/out.pkl',))",
+        "df.agg({'age': f'to_pickle'}, '/tmp/out.pkl')",
+        "df.values.tofile('/tmp/out.bin')",
+        "df.dropna(inplace=True)",
+        "df.sort_values('age', inplace=True)",
+        "df.query('age > 30')",
+        "df.__class__",
+        "f'{df.__class__}'",
+        "__import__('os')",
+        "open('/tmp/secret.csv').read()",
+    ],
+)
+def test_validate_query_rejects_unsafe_queries(query: str):
+    """
+    Tests that queries reaching interpreter internals, the environment or the file system are rejected.
+    """
+    with pytest.raises(ValueError):
+        validate_query(parse_query(query))
+
+
+def test_evaluate_query_rejects_format_string_escape(monkeypatch):
+    """
+    Tests that a str.format attribute chain cannot read environment variables through evaluate_query.
+    """
+    monkeypatch.setenv("DATABOT_TEST_SECRET", "secret")
+    df = pd.DataFrame({"age": [25, 35]})
+    query = "'{0.__init__.__globals__[sys].modules[os].environ[DATABOT_TEST_SECRET]}'.format(df)"
+
+    with pytest.raises(ValueError):
+        evaluate_query(df, query)
@@ -0,0 +1,26 @@
+from src.agent import throttle_stream
+
+
+def test_throttle_stream_batches_chunks_within_interval():
+    """
+    Tests that chunks arriving within the flush interval are joined into one piece.
+    """
+    chunks = ["Hello", ", ", "world", "!"]
+
+    assert list(throttle_stream(iter(chunks), interval=60)) == ["Hello, world!"]
+
+
+def test_throttle_stream_flushes_every_chunk_without_interval():
+    """
+    Tests that every chunk is yielded on its own when the interval is zero.
+    """
+    chunks = ["a", "b", "c"]
+
+    assert list(throttle_stream(iter(chunks), interval=0)) == chunks
+
+
+def test_throttle_stream_handles_empty_stream():
+    """
+    Tests that an empty stream yields nothing.
+    """
+    assert list(throttle_stream(iter([]), interval=0)) == []